@@ -1 +1,2 @@
 from .rossmart import RosSmart, RosSmartException, enable_lowlevel_trace
+from .export import ColumnarExporter
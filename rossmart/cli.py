@@ -0,0 +1,411 @@
+#
+#   cli.py
+#
+#   Command line interface to the ROS SMART payroll API.
+#
+#       python -m rossmart --help
+#
+#   Payslips are read as a stream from NDJSON or CSV, grouped into batches and
+#   uploaded as separate submissions to the same payroll run. Only the batches
+#   currently in flight are held in memory, so arbitrarily large files can be
+#   processed. Results are written as NDJSON as each submission completes.
+#
+import argparse
+import csv
+import decimal
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .rossmart import RosSmart, RosSmartException, DecimalEncoder, enable_lowlevel_trace
+
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CONCURRENCY = 4
+
+# Payslip field types, taken from the Payslip definition in paye-employers-rest-api.json
+# and the objects it references. CSV cells are all strings, so these are needed to build
+# a valid payload. Fields are keyed by their full dotted path: nested objects (employeeID,
+# name, address) are given as dotted column names, e.g. "employeeID.employeePpsn".
+# Array fields are given as JSON in a single cell.
+PAYSLIP_NUMBER_FIELDS = frozenset([
+    "taxCredits", "grossPay", "payForIncomeTax", "incomeTaxPaid", "payForEmployeePRSI",
+    "payForEmployerPRSI", "employeePRSIPaid", "employerPRSIPaid", "payForUSC", "uscPaid",
+    "lptDeducted", "grossMedicalInsurance", "shareBasedRemuneration", "taxableBenefits",
+    "taxableLumpSum", "nonTaxableLumpSum", "employerRBS", "employeeRBS", "employerPRSA",
+    "employeePRSA", "employeeRAC", "employeeAVC", "employeeASC"])
+PAYSLIP_INTEGER_FIELDS = frozenset(["numberOfPayPeriods"])
+PAYSLIP_BOOLEAN_FIELDS = frozenset(["shadowPayroll", "exclusionOrder", "prsiExempt"])
+PAYSLIP_ARRAY_FIELDS = frozenset(["taxRates", "prsiClassDetails", "pensionTracingNumbers", "address.addressLines"])
+
+
+# ---[ Input ]------------------------------------------
+
+def _csv_value(name, value):
+    """
+        Convert a single CSV cell to the type the API expects for the field.
+
+        name is the full dotted path of the field, e.g. "address.addressLines".
+    """
+    if name in PAYSLIP_NUMBER_FIELDS:
+        return decimal.Decimal(value)
+    if name in PAYSLIP_INTEGER_FIELDS:
+        return int(value)
+    if name in PAYSLIP_BOOLEAN_FIELDS:
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    if name in PAYSLIP_ARRAY_FIELDS:
+        return json.loads(value)
+    return value
+
+
+def csv_to_payslip(row, rowno=None):
+    """
+        Convert a csv.DictReader row to a payslip dict.
+
+        Empty cells are omitted. Dotted column names build nested objects.
+        rowno is only used in error messages.
+    """
+    payslip = {}
+    for column, value in row.items():
+        if column is None or value is None or value == '':
+            continue
+        name = column.strip()
+        parts = name.split('.')
+        target = payslip
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        try:
+            value = _csv_value(name, value)
+        except (ValueError, decimal.InvalidOperation) as e:
+            raise RosSmartException(message="Invalid value for %s on row %s: %r" % (column, rowno, value),
+                original_exception=e)
+        target[parts[-1]] = value
+    return payslip
+
+
+def read_payslips(fh, format='ndjson'):
+    """
+        Generator yielding payslips one at a time from an open text file.
+
+        format: "ndjson" (one JSON object per line) or "csv" (header row required)
+
+        CSV rows are numbered as in a spreadsheet, the header being row 1.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(fh)
+        rowno = 1
+        while True:
+            rowno += 1
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                raise RosSmartException(message="Invalid CSV on row %s: %s" % (rowno, e), original_exception=e)
+            yield csv_to_payslip(row, rowno)
+    else:
+        for lineno, line in enumerate(fh, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line, parse_float=decimal.Decimal)
+            except ValueError as e:
+                raise RosSmartException(message="Invalid JSON on line %s: %s" % (lineno, e), original_exception=e)
+
+
+def batched(iterable, size):
+    """
+        Group an iterable into lists of at most size items.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ---[ Output ]------------------------------------------
+
+def write_ndjson(out, record):
+    out.write(json.dumps(record, sort_keys=True, cls=DecimalEncoder))
+    out.write('\n')
+    out.flush()
+
+
+class Progress(object):
+    """
+        Report counts and throughput on stderr, at most once per interval seconds.
+    """
+
+    def __init__(self, stream=None, interval=1.0, enabled=True):
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.enabled = enabled
+        self.started = self.last_report = time.time()
+        self.read = 0
+        self.submitted = 0
+        self.batches = 0
+        self.failed = 0
+
+    def report(self, force=False):
+        if not self.enabled:
+            return
+        now = time.time()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        self.stream.write(
+            "read %d, submitted %d in %d batches (%d failed), %.1f payslips/s, %.1fs\n" % (
+                self.read, self.submitted, self.batches, self.failed, self.submitted / elapsed, elapsed))
+        self.stream.flush()
+
+
+# ---[ Submission ]------------------------------------------
+
+def submit_batch(api, payrollRunReference, payslips):
+    """
+        Upload a single batch as a new submission. Errors are returned in the result,
+        not raised, so that one bad batch does not stop the run.
+    """
+    submissionID = api.mk_unique_id()
+    result = {
+        "payrollRunReference": payrollRunReference,
+        "submissionID": submissionID,
+        "payslips": len(payslips),
+        "lineItemIDs": [p.get("lineItemID") for p in payslips],
+    }
+    try:
+        response = api.createPayrollSubmission(payrollRunReference, submissionID, payslips)
+        result["ok"] = not (response or {}).get("validationErrors")
+        result["response"] = response
+    except RosSmartException as e:
+        result["ok"] = False
+        result["error"] = e.message
+        result["status_code"] = e.status_code
+        result["response"] = e.text
+    except Exception as e:
+        result["ok"] = False
+        result["error"] = str(e)
+    return result
+
+
+def submit_payslips(api, payrollRunReference, payslips, out, batch_size=DEFAULT_BATCH_SIZE,
+        concurrency=DEFAULT_CONCURRENCY, progress=None):
+    """
+        Batch a stream of payslips into submissions and upload them using a pool of threads.
+
+        At most `concurrency` batches are in flight at a time; reading from the input is
+        paused until one completes. Results are written to out as they arrive, so the
+        output order is completion order, not input order.
+
+        If reading the input fails, the batches already in flight are still completed and
+        their results written, followed by an error record with the number of payslips read
+        and sent, before the exception is re-raised. Payslips after those sent were not
+        submitted.
+
+        Returns the number of failed batches.
+    """
+    progress = progress or Progress(enabled=False)
+
+    def counted(payslips):
+        for payslip in payslips:
+            progress.read += 1
+            yield payslip
+
+    def collect(done):
+        for future in done:
+            result = future.result()
+            progress.batches += 1
+            if result["ok"]:
+                progress.submitted += result["payslips"]
+            else:
+                progress.failed += 1
+            write_ndjson(out, result)
+        progress.report()
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = set()
+    sent = 0
+    try:
+        try:
+            for batch in batched(counted(payslips), batch_size):
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(submit_batch, api, payrollRunReference, batch))
+                sent += len(batch)
+        finally:
+            # Batches in flight reach ROS regardless, so their submissionIDs must be reported
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+    except Exception as e:
+        write_ndjson(out, {
+            "payrollRunReference": payrollRunReference,
+            "ok": False,
+            "error": "Stopped after reading %d payslips, %d sent: %s" % (progress.read, sent, e),
+            "payslipsRead": progress.read,
+            "payslipsSent": sent,
+        })
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        progress.report(force=True)
+    return progress.failed
+
+
+# ---[ Commands ]------------------------------------------
+
+def cmd_handshake(api, args, out):
+    write_ndjson(out, api.handshake())
+    return 0
+
+
+def cmd_rpn(api, args, out):
+    """
+        Write one RPN per line. noRPNs and validationErrors are written as tagged records.
+    """
+    if args.employee_id and len(args.employee_id) == 1 and not args.date_last_updated:
+        response = api.lookUpRPNByEmployee(args.employee_id[0])
+    else:
+        response = api.lookUpRPNByEmployer(dateLastUpdated=args.date_last_updated, employeeIDs=args.employee_id)
+    for rpn in response.get('rpns') or []:
+        write_ndjson(out, rpn)
+    for employeeID in response.get('noRPNs') or []:
+        write_ndjson(out, {"noRPN": employeeID})
+    for error in response.get('validationErrors') or []:
+        write_ndjson(out, {"validationError": error})
+    return 0
+
+
+def cmd_submit(api, args, out):
+    if args.input == '-':
+        fh = sys.stdin
+    else:
+        fh = io.open(args.input, 'r', encoding='utf-8', newline='')
+    format = args.format
+    if format is None:
+        format = 'csv' if args.input.lower().endswith('.csv') else 'ndjson'
+    progress = Progress(interval=args.progress_interval, enabled=not args.quiet)
+    try:
+        failed = submit_payslips(
+            api, args.run_reference, read_payslips(fh, format), out,
+            batch_size=args.batch_size, concurrency=args.concurrency, progress=progress)
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    return 1 if failed else 0
+
+
+def cmd_status(api, args, out):
+    if args.submission_id:
+        for submissionID in args.submission_id:
+            write_ndjson(out, api.checkPayrollSubmissionRequest(args.run_reference, submissionID))
+    else:
+        write_ndjson(out, api.checkPayrollRunComplete(args.run_reference))
+    return 0
+
+
+# ---[ Argument parsing ]------------------------------------------
+
+def _positive_int(value):
+    value = int(value)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m rossmart", description="ROS SMART PAYE Employers API client")
+    parser.add_argument("--public-key", dest="public_key_path", default=os.environ.get("ROSSMART_PUBLIC_KEY"),
+        help="Path to public key (env ROSSMART_PUBLIC_KEY)")
+    parser.add_argument("--private-key", dest="private_key_path", default=os.environ.get("ROSSMART_PRIVATE_KEY"),
+        help="Path to encrypted private key (env ROSSMART_PRIVATE_KEY)")
+    parser.add_argument("--password", default=os.environ.get("ROSSMART_PASSWORD"),
+        help="Certificate password (env ROSSMART_PASSWORD)")
+    parser.add_argument("--hashed-password", default=os.environ.get("ROSSMART_HASHED_PASSWORD"),
+        help="Hashed certificate password, instead of --password (env ROSSMART_HASHED_PASSWORD)")
+    parser.add_argument("--employer", dest="employerRegistrationNumber", default=os.environ.get("ROSSMART_EMPLOYER"),
+        help="Employer registration number (env ROSSMART_EMPLOYER)")
+    parser.add_argument("--tax-year", dest="taxYear", default=os.environ.get("ROSSMART_TAX_YEAR"),
+        help="Tax year, YYYY (env ROSSMART_TAX_YEAR)")
+    parser.add_argument("--test-server", action="store_true", help="Use the ROS public interface test service")
+    parser.add_argument("--output", "-o", default="-", help="Write NDJSON results to this file (default stdout)")
+    parser.add_argument("--trace", action="store_true", help="Turn on low-level http tracing")
+
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    p = subparsers.add_parser("handshake", help="Verify keys and connection")
+    p.set_defaults(func=cmd_handshake)
+
+    p = subparsers.add_parser("rpn", help="Export RPNs as NDJSON, one per line")
+    p.add_argument("--date-last-updated", help="Only RPNs updated since YYYY-MM-DD")
+    p.add_argument("--employee-id", action="append", help="PPSN-employmentID, may be repeated")
+    p.set_defaults(func=cmd_rpn)
+
+    p = subparsers.add_parser("submit", help="Stream payslips from NDJSON or CSV into payroll submissions")
+    p.add_argument("input", help="Payslip file, or - for stdin")
+    p.add_argument("--run-reference", required=True, help="Payroll run reference")
+    p.add_argument("--format", choices=["ndjson", "csv"], help="Input format (default from file extension)")
+    p.add_argument("--batch-size", type=_positive_int, default=DEFAULT_BATCH_SIZE, help="Payslips per submission")
+    p.add_argument("--concurrency", type=_positive_int, default=DEFAULT_CONCURRENCY, help="Submissions in flight")
+    p.add_argument("--progress-interval", type=float, default=1.0, help="Seconds between progress reports")
+    p.add_argument("--quiet", "-q", action="store_true", help="No progress reports")
+    p.set_defaults(func=cmd_submit)
+
+    p = subparsers.add_parser("status", help="Check payroll run or submission status")
+    p.add_argument("--run-reference", required=True, help="Payroll run reference")
+    p.add_argument("--submission-id", action="append", help="Submission ID, may be repeated")
+    p.set_defaults(func=cmd_status)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if not args.public_key_path or not args.private_key_path:
+        parser.error("--public-key and --private-key are required")
+    if not args.password and not args.hashed_password:
+        parser.error("--password or --hashed-password is required")
+    if not args.employerRegistrationNumber:
+        parser.error("--employer is required")
+    if not args.taxYear and args.command != "handshake":
+        parser.error("--tax-year is required")
+
+    if args.trace:
+        enable_lowlevel_trace()
+
+    api = RosSmart(
+        public_key_path=args.public_key_path,
+        private_key_path=args.private_key_path,
+        taxYear=args.taxYear,
+        hashed_password=args.hashed_password,
+        password=args.password,
+        employerRegistrationNumber=args.employerRegistrationNumber,
+        test_server=args.test_server)
+
+    if args.output == '-':
+        out = sys.stdout
+    else:
+        out = io.open(args.output, 'w', encoding='utf-8')
+    try:
+        return args.func(api, args, out)
+    except RosSmartException as e:
+        sys.stderr.write("%s\n" % e)
+        if e.text:
+            sys.stderr.write("%s\n" % e.text)
+        return 2
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,501 @@
+#
+#   export.py
+#
+#   Export RPN and period return lookups to typed columnar files for analytics.
+#
+#   Responses from lookUpRPNByEmployer and lookUpPayrollReturnByPeriod are flattened
+#   into four tables:
+#
+#       rpns            one row per RPN
+#       rates           one row per taxRates / uscRates band of an RPN
+#       returns         one row per period return (periodSummary totals)
+#       payroll_runs    one row per payrollRunDetails entry of a period return
+#
+#   Rows are buffered and written in chunks as responses are added, so an export
+#   across many employers and tax years is never held in memory at once.
+#
+#   Formats:
+#
+#       arrow       <path>/<table>.arrow, Arrow IPC file (requires pyarrow)
+#       parquet     <path>/<table>.parquet (requires pyarrow)
+#       numpy       <path>/<table>/<column>.npy, one array per column (requires numpy)
+#
+#   Tables are written under a ".partial" name and renamed when the export is closed,
+#   once every table has been finished. If the export fails, all tables are left under
+#   the ".partial" name and any previous export is untouched, so a failed export is
+#   never mistaken for a complete one.
+#
+#   The arrow and numpy formats can be memory-mapped when read back, e.g.
+#
+#       pyarrow.ipc.open_file(pyarrow.memory_map('export/rpns.arrow')).read_all()
+#       rossmart.export.load_numpy('export', 'rpns')
+#
+import datetime
+import logging
+import os
+import shutil
+
+FORMATS = ("arrow", "parquet", "numpy")
+DEFAULT_CHUNK_SIZE = 10000
+PARTIAL = ".partial"
+
+logger = logging.getLogger("rossmart")
+
+# Column definitions: (name, type, width). Width is the maximum string length, taken
+# from the maxLength, pattern or enum values in paye-employers-rest-api.json. It is
+# only used for fixed-width numpy strings; longer values are rejected when written.
+RPN_COLUMNS = [
+    ("employerRegistrationNumber", "string", 10),  # maxLength is 100, but the pattern allows 10
+    ("taxYear", "int", None),
+    ("rpnNumber", "string", 20),
+    ("employeePpsn", "string", 10),
+    ("employmentID", "string", 20),
+    ("employerReference", "string", 50),
+    ("firstName", "string", 100),
+    ("familyName", "string", 100),
+    ("previousEmployeePPSN", "string", 10),
+    ("rpnIssueDate", "date", None),
+    ("effectiveDate", "date", None),
+    ("endDate", "date", None),
+    ("incomeTaxCalculationBasis", "string", 10),   # enum
+    ("exclusionOrder", "bool", None),
+    ("yearlyTaxCredits", "float", None),
+    ("payForIncomeTaxToDate", "float", None),
+    ("incomeTaxDeductedToDate", "float", None),
+    ("uscStatus", "string", 8),                    # enum
+    ("payForUSCToDate", "float", None),
+    ("uscDeductedToDate", "float", None),
+    ("lptToDeduct", "float", None),
+    ("prsiExempt", "bool", None),
+    ("prsiClass", "string", 2),                    # pattern
+]
+
+RATE_COLUMNS = [
+    ("employerRegistrationNumber", "string", 10),
+    ("taxYear", "int", None),
+    ("rpnNumber", "string", 20),
+    ("employeePpsn", "string", 10),
+    ("employmentID", "string", 20),
+    ("rateType", "string", 3),                      # TAX or USC
+    ("index", "int", None),
+    ("ratePercent", "float", None),
+    ("cutOff", "float", None),                      # No cut off for the highest band
+]
+
+RETURN_COLUMNS = [
+    ("employerRegistrationNumber", "string", 10),
+    ("periodStartDate", "date", None),
+    ("periodEndDate", "date", None),
+    ("dateLastUpdated", "string", 35),             # ISO 8601 date-time
+    ("version", "string", 100),
+    ("taxOnIncome", "float", None),
+    ("prsi", "float", None),
+    ("usc", "float", None),
+    ("lpt", "float", None),
+]
+
+PAYROLL_RUN_COLUMNS = [
+    ("employerRegistrationNumber", "string", 10),
+    ("periodStartDate", "date", None),
+    ("periodEndDate", "date", None),
+    ("payrollRunReference", "string", 50),
+    ("runDate", "date", None),
+    ("multiPeriod", "bool", None),
+    ("taxOnIncome", "float", None),
+    ("prsi", "float", None),
+    ("usc", "float", None),
+    ("lpt", "float", None),
+]
+
+TABLES = {
+    "rpns": RPN_COLUMNS,
+    "rates": RATE_COLUMNS,
+    "returns": RETURN_COLUMNS,
+    "payroll_runs": PAYROLL_RUN_COLUMNS,
+}
+
+
+def _date(value):
+    """
+        ROS returns dates as YYYY-MM-DD. Date-times are truncated to the date.
+    """
+    if not value:
+        return None
+    return datetime.datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+
+def _float(value):
+    if value is None:
+        return None
+    return float(value)
+
+
+# ---[ Flattening ]------------------------------------------
+
+def rpn_rows(response):
+    """
+        Flatten a lookUpRPNByEmployer / lookUpRPNByEmployee response.
+
+        Yields (rpn_row, rate_rows) for each RPN in the response.
+    """
+    employer = response.get("employerRegistrationNumber")
+    taxYear = response.get("taxYear")
+    taxYear = int(taxYear) if taxYear is not None else None
+
+    for rpn in response.get("rpns") or []:
+        employeeID = rpn.get("employeeID") or {}
+        name = rpn.get("name") or {}
+        key = {
+            "employerRegistrationNumber": employer,
+            "taxYear": taxYear,
+            "rpnNumber": rpn.get("rpnNumber"),
+            "employeePpsn": employeeID.get("employeePpsn"),
+            "employmentID": employeeID.get("employmentID"),
+        }
+        row = dict(key)
+        row.update({
+            "employerReference": rpn.get("employerReference"),
+            "firstName": name.get("firstName"),
+            "familyName": name.get("familyName"),
+            "previousEmployeePPSN": rpn.get("previousEmployeePPSN"),
+            "rpnIssueDate": _date(rpn.get("rpnIssueDate")),
+            "effectiveDate": _date(rpn.get("effectiveDate")),
+            "endDate": _date(rpn.get("endDate")),
+            "incomeTaxCalculationBasis": rpn.get("incomeTaxCalculationBasis"),
+            "exclusionOrder": rpn.get("exclusionOrder"),
+            "yearlyTaxCredits": _float(rpn.get("yearlyTaxCredits")),
+            "payForIncomeTaxToDate": _float(rpn.get("payForIncomeTaxToDate")),
+            "incomeTaxDeductedToDate": _float(rpn.get("incomeTaxDeductedToDate")),
+            "uscStatus": rpn.get("uscStatus"),
+            "payForUSCToDate": _float(rpn.get("payForUSCToDate")),
+            "uscDeductedToDate": _float(rpn.get("uscDeductedToDate")),
+            "lptToDeduct": _float(rpn.get("lptToDeduct")),
+            "prsiExempt": rpn.get("prsiExempt"),
+            "prsiClass": rpn.get("prsiClass"),
+        })
+
+        rates = []
+        for band in rpn.get("taxRates") or []:
+            rate = dict(key)
+            rate.update({
+                "rateType": "TAX",
+                "index": band.get("index"),
+                "ratePercent": _float(band.get("taxRatePercent")),
+                "cutOff": _float(band.get("yearlyRateCutOff")),
+            })
+            rates.append(rate)
+        for band in rpn.get("uscRates") or []:
+            rate = dict(key)
+            rate.update({
+                "rateType": "USC",
+                "index": band.get("index"),
+                "ratePercent": _float(band.get("uscRatePercent")),
+                "cutOff": _float(band.get("yearlyUSCRateCutOff")),
+            })
+            rates.append(rate)
+
+        yield row, rates
+
+
+def return_rows(response):
+    """
+        Flatten a lookUpPayrollReturnByPeriod response.
+
+        Returns (return_row, payroll_run_rows).
+    """
+    period = response.get("returnPeriod") or {}
+    summary = response.get("periodSummary") or {}
+    key = {
+        "employerRegistrationNumber": response.get("employerReg"),
+        "periodStartDate": _date(period.get("periodStartDate")),
+        "periodEndDate": _date(period.get("periodEndDate")),
+    }
+    row = dict(key)
+    row.update({
+        "dateLastUpdated": response.get("dateLastUpdated"),
+        "version": response.get("version"),
+        "taxOnIncome": _float(summary.get("taxOnIncome")),
+        "prsi": _float(summary.get("prsi")),
+        "usc": _float(summary.get("usc")),
+        "lpt": _float(summary.get("lpt")),
+    })
+
+    runs = []
+    for details in response.get("payrollRunDetails") or []:
+        run = dict(key)
+        run.update({
+            "payrollRunReference": details.get("payrollRunReference"),
+            "runDate": _date(details.get("runDate")),
+            "multiPeriod": details.get("multiPeriod"),
+            "taxOnIncome": _float(details.get("taxOnIncome")),
+            "prsi": _float(details.get("prsi")),
+            "usc": _float(details.get("usc")),
+            "lpt": _float(details.get("lpt")),
+        })
+        runs.append(run)
+    return row, runs
+
+
+# ---[ Writers ]------------------------------------------
+
+class _ArrowWriter(object):
+    """
+        Write chunks to a single Arrow IPC or Parquet file.
+    """
+
+    def __init__(self, target, columns, format):
+        import pyarrow
+        self.pa = pyarrow
+        types = {
+            "string": pyarrow.string(),
+            "int": pyarrow.int32(),
+            "float": pyarrow.float64(),
+            "bool": pyarrow.bool_(),
+            "date": pyarrow.date32(),
+        }
+        self.schema = pyarrow.schema([pyarrow.field(name, types[type]) for name, type, width in columns])
+        self.format = format
+        if format == "parquet":
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(target, self.schema)
+        else:
+            self.sink = pyarrow.OSFile(target, "wb")
+            self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+
+    def write(self, data):
+        arrays = [self.pa.array(data[field.name], type=field.type) for field in self.schema]
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.format == "parquet":
+            self.writer.write_table(self.pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        if self.format != "parquet":
+            self.sink.close()
+
+
+class _NumpyWriter(object):
+    """
+        Write chunks to one .npy file per column.
+
+        The row count is not known until the end, so column data is appended to a raw
+        file while writing and copied under an .npy header on close.
+
+        Missing values are NaN for floats, NaT for dates, 0 for ints, False for bools
+        and "" for strings. Strings longer than the column width raise ValueError rather
+        than being truncated.
+    """
+
+    COPY_ROWS = 1 << 20
+
+    def __init__(self, target, columns, format):
+        import numpy
+        self.np = numpy
+        self.dir = target
+        if not os.path.isdir(self.dir):
+            os.makedirs(self.dir)
+        dtypes = {"int": "<i4", "float": "<f8", "bool": "?", "date": "<M8[D]"}
+        self.columns = [(name, numpy.dtype("<U%d" % width if type == "string" else dtypes[type]), type)
+                        for name, type, width in columns]
+        self.widths = dict((name, width) for name, type, width in columns if type == "string")
+        self.files = dict((name, open(os.path.join(self.dir, name + ".bin"), "wb")) for name, dtype, type in self.columns)
+        self.rows = 0
+
+    def write(self, data):
+        np = self.np
+        for name, dtype, type in self.columns:
+            values = data[name]
+            if type == "float":
+                values = [np.nan if v is None else v for v in values]
+            elif type == "int":
+                values = [0 if v is None else v for v in values]
+            elif type == "bool":
+                values = [bool(v) for v in values]
+            elif type == "string":
+                values = ["" if v is None else v for v in values]
+                width = self.widths[name]
+                for v in values:
+                    if len(v) > width:
+                        raise ValueError("%s value %r is longer than %d characters" % (name, v, width))
+            np.asarray(values, dtype=dtype).tofile(self.files[name])
+        self.rows += len(data[self.columns[0][0]])
+
+    def close(self):
+        np = self.np
+        for name, dtype, type in self.columns:
+            self.files[name].close()
+            raw_path = os.path.join(self.dir, name + ".bin")
+            npy_path = os.path.join(self.dir, name + ".npy")
+            if self.rows:
+                raw = np.memmap(raw_path, dtype=dtype, mode="r", shape=(self.rows,))
+                out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=dtype, shape=(self.rows,))
+                for start in range(0, self.rows, self.COPY_ROWS):
+                    out[start:start + self.COPY_ROWS] = raw[start:start + self.COPY_ROWS]
+                out.flush()
+                del raw, out
+            else:
+                np.save(npy_path, np.empty(0, dtype=dtype))
+            os.remove(raw_path)
+
+
+class _Table(object):
+    """
+        Buffer rows for one table and hand them to the writer in chunks.
+    """
+
+    def __init__(self, path, name, columns, format, chunk_size):
+        if format == "numpy":
+            self.target = os.path.join(path, name)
+        else:
+            self.target = os.path.join(path, name + "." + format)
+        self.columns = columns
+        self.format = format
+        self.chunk_size = chunk_size
+        self.writer = None
+        self.rows = 0
+        self._reset()
+
+    def _reset(self):
+        self.data = dict((name, []) for name, type, width in self.columns)
+        self.buffered = 0
+
+    def append(self, row):
+        for name, type, width in self.columns:
+            self.data[name].append(row.get(name))
+        self.buffered += 1
+        self.rows += 1
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.writer is None:
+            cls = _NumpyWriter if self.format == "numpy" else _ArrowWriter
+            self.writer = cls(self.target + PARTIAL, self.columns, self.format)
+        if self.buffered:
+            self.writer.write(self.data)
+            self._reset()
+
+    def finish(self):
+        """
+            Write any buffered rows and finish the file, still under the partial name.
+        """
+        try:
+            self.flush()
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+
+    def replace(self):
+        """
+            Move the finished file into place, replacing any previous export.
+        """
+        if os.path.isdir(self.target):
+            shutil.rmtree(self.target)
+        elif os.path.exists(self.target):
+            os.remove(self.target)
+        os.rename(self.target + PARTIAL, self.target)
+
+    def abort(self):
+        """
+            Release the file, leaving it under the partial name. Buffered rows are dropped.
+        """
+        if self.writer is not None:
+            self.writer.close()
+
+
+class ColumnarExporter(object):
+    """
+    Flatten RPN and period return lookups into columnar files, written incrementally.
+
+    Parameters:
+
+        path: Directory to write the tables to. Created if it does not exist.
+        format: "arrow", "parquet" or "numpy"
+        chunk_size: Rows buffered per table before a chunk is written
+
+    Example, exporting every employer and tax year::
+
+        with ColumnarExporter("export", format="arrow") as exporter:
+            for api in connections:
+                exporter.add_rpns(api.lookUpRPNByEmployer())
+                exporter.add_period_return(api.lookUpPayrollReturnByPeriod("2019-01-01", "2019-01-31"))
+    """
+
+    def __init__(self, path, format="parquet", chunk_size=DEFAULT_CHUNK_SIZE):
+        if format not in FORMATS:
+            raise ValueError("format must be one of %s" % ", ".join(FORMATS))
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.format = format
+        self.tables = dict(
+            (name, _Table(path, name, columns, format, chunk_size)) for name, columns in TABLES.items())
+
+    def add_rpns(self, response):
+        """
+            Add a lookUpRPNByEmployer or lookUpRPNByEmployee response.
+        """
+        for row, rates in rpn_rows(response):
+            self.tables["rpns"].append(row)
+            for rate in rates:
+                self.tables["rates"].append(rate)
+
+    def add_period_return(self, response):
+        """
+            Add a lookUpPayrollReturnByPeriod response.
+        """
+        row, runs = return_rows(response)
+        self.tables["returns"].append(row)
+        for run in runs:
+            self.tables["payroll_runs"].append(run)
+
+    def close(self):
+        """
+            Write any buffered rows and finish the files. Tables with no rows are still written.
+
+            The previous export is only replaced once every table has finished. If any table
+            fails, all are left under ".partial" names and the first error is raised.
+        """
+        error = None
+        for name, table in sorted(self.tables.items()):
+            try:
+                table.finish()
+            except Exception as e:
+                logger.error("Export of table [%s] failed: %s" % (name, e))
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+        for name, table in sorted(self.tables.items()):
+            table.replace()
+
+    def abort(self):
+        """
+            Stop the export without finishing it. Tables are left under ".partial" names.
+        """
+        for name, table in sorted(self.tables.items()):
+            try:
+                table.abort()
+            except Exception as e:
+                logger.error("Abort of table [%s] failed: %s" % (name, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def load_numpy(path, table, mmap_mode="r"):
+    """
+        Load a table written in the numpy format as a dict of memory-mapped column arrays.
+    """
+    import numpy
+    return dict(
+        (name, numpy.load(os.path.join(path, table, name + ".npy"), mmap_mode=mmap_mode))
+        for name, type, width in TABLES[table])
@@ -9,9 +9,11 @@
 #
 #   https://revenue-ie.github.io/paye-employers-documentation/rest/paye-employers-rest-api.html
 #
+#   requests and requests_http_signature (and through it, cryptography) are imported
+#   on first use, so that "import rossmart" is cheap for short-lived processes.
+#
 import json
 import uuid
-import requests
 import decimal
 try:
     from urllib import urlencode
@@ -25,8 +27,7 @@ except:
     from hashlib import md5
 import base64
 import hashlib
-
-from requests_http_signature import HTTPSignatureHeaderAuth
+import time
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -53,6 +54,54 @@ def enable_lowlevel_trace(enable=True):
         http_client.HTTPConnection.debuglevel = 0
 
 
+_signature_auth = None
+
+
+def _signature_auth_class():
+    """
+        The HTTPSignatureHeaderAuth class used to sign requests, defined on first use so
+        that requests_http_signature and cryptography are only imported when needed.
+
+        requests_http_signature passes the private key PEM to load_pem_private_key on every
+        request, which decrypts it and validates the RSA key - tens of milliseconds each
+        time. This subclass is given the key object, loaded once per client, and signs
+        with it directly. The signature string is built as in requests_http_signature 0.2.x.
+    """
+    global _signature_auth
+    if _signature_auth is None:
+        from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+        from cryptography.hazmat.primitives.hashes import SHA256, SHA512
+        from requests_http_signature import HTTPSignatureHeaderAuth
+
+        class KeyObjectSignatureAuth(HTTPSignatureHeaderAuth):
+            hashers = {"rsa-sha256": SHA256, "rsa-sha512": SHA512}
+
+            def create_signature_string(self, request):
+                if self.algorithm not in self.hashers:
+                    raise ValueError("Cannot sign %s with a loaded key" % self.algorithm)
+                created_timestamp = int(time.time())
+                expires_timestamp = None
+                if self.expires_in is not None:
+                    expires_timestamp = created_timestamp + self.expires_in.total_seconds()
+                self.add_date(request, created_timestamp)
+                self.add_digest(request)
+                string_to_sign = self.get_string_to_sign(request, self.headers, created_timestamp, expires_timestamp)
+                raw_sig = self.key.sign(string_to_sign, PKCS1v15(), self.hashers[self.algorithm]())
+                sig_struct = [
+                    ("keyId", self.key_id),
+                    ("algorithm", self.algorithm),
+                    ("headers", " ".join(self.headers)),
+                    ("signature", base64.b64encode(raw_sig).decode()),
+                    ("created", created_timestamp),
+                ]
+                if expires_timestamp is not None:
+                    sig_struct.append(("expires", int(expires_timestamp)))
+                return ",".join('{}="{}"'.format(k, v) for k, v in sig_struct)
+
+        _signature_auth = KeyObjectSignatureAuth
+    return _signature_auth
+
+
 TEST_ROOT = 'https://softwaretest.ros.ie/paye-employers/v1/rest'
 LIVE_ROOT = 'https://ros.ie/paye-employers/v1/rest'
 
@@ -108,6 +157,17 @@ class RosSmart:
         employerRegistrationNumber: Your employer id
         test_service: Set to false to use live URLs - not published yet.
         hashed_password: use hashed password instead of original password
+        public_key: Public key (certificate PEM) as bytes/str, instead of public_key_path
+        private_key: Encrypted private key PEM as bytes/str, instead of private_key_path
+        lazy_keys: Do not read or parse the keys until the first request
+        key_cache: A dict shared between instances. Keys read from files are stored in it
+                   already parsed - the key id, and the decrypted private key object - and
+                   reused by clients with the same paths (and password).
+
+    Unless lazy_keys is set, the keys are read and the private key is decrypted when the
+    client is created, so a wrong password or a bad key raises RosSmartException from the
+    constructor rather than from the first request. The decrypted key object is kept in
+    signing_key and used to sign every request; private_key holds the encrypted PEM.
 
     The following class attributes can be overridden in a subclass. These are passed on all
     requests to the API.
@@ -119,6 +179,10 @@ class RosSmart:
 
     public_key = None
     private_key = None
+    signing_key = None
+    public_key_path = None
+    private_key_path = None
+    key_cache = None
     hashed_password = None
     url_root = False
 
@@ -141,7 +205,11 @@ class RosSmart:
             hashed_password=None,                          # Hashed password
             password=None,                                 # Original Password
             employerRegistrationNumber=None,               # Employers Reference Number
-            test_server=False):
+            test_server=False,
+            public_key=None,                               # In-memory key material
+            private_key=None,
+            lazy_keys=False,                               # Defer loading keys to first request
+            key_cache=None):                               # dict shared between instances
 
         self.taxYear = taxYear
         self.employerRegistrationNumber = employerRegistrationNumber
@@ -156,16 +224,18 @@ class RosSmart:
         else:
             self.hashed_password = self.hash_password(password)
 
-        # Cannot run  algorithm="rsa-sha256" at the moment, no valid key.
-        with open(public_key_path, 'rb') as fh:
-            public_key = []
-            for line in fh.readlines():
-                if line and not line.startswith(b'----'):
-                    public_key.append(line.strip())
-            self.public_key = b''.join(public_key)
+        if public_key is not None:
+            self.public_key = self.parse_public_key(public_key)
+        if private_key is not None:
+            self.private_key = private_key.encode('ascii') if type(private_key) != bytes else private_key
+
+        self.public_key_path = public_key_path
+        self.private_key_path = private_key_path
+        if key_cache is not None:
+            self.key_cache = key_cache
 
-        with open(private_key_path, 'rb') as fh:
-            self.private_key = fh.read()
+        if not lazy_keys:
+            self.load_keys()
 
     # ---- [ API Simplifications ]-----------------------------------------------------
 
@@ -338,12 +408,71 @@ class RosSmart:
                 3.  Finally, create the new password by Base64-encoding the bytes from the previous step. For
                     example, the password, "Password123" this is "QvdJref54ZW/R183pEyvyw==".
         """
-        rv = base64.encodestring(md5(original.encode('utf-8')).digest())
+        # encodestring was removed in Python 3.9
+        encode = getattr(base64, 'encodebytes', None) or base64.encodestring
+        rv = encode(md5(original.encode('utf-8')).digest())
         if type(rv) == bytes:
             return rv.replace(b'\n', b'')
         else:
             return rv.replace('\n', '')
 
+    @classmethod
+    def parse_public_key(cls, pem):
+        """
+            Convert the public key (certificate) PEM to the key id used to sign requests,
+            i.e. the base64 body without the ---- BEGIN/END lines or line breaks.
+        """
+        if type(pem) != bytes:
+            pem = pem.encode('ascii')
+        return b''.join(line.strip() for line in pem.splitlines() if not line.startswith(b'----'))
+
+    def parse_private_key(self, pem):
+        """
+            Decrypt and load the private key PEM using the hashed password. The key object
+            is used to sign every request, so this is done once per client (or key_cache).
+        """
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+        password = self.hashed_password
+        if password is not None and type(password) != bytes:
+            password = password.encode('utf-8')
+        try:
+            return load_pem_private_key(pem, password=password, backend=default_backend())
+        except (ValueError, TypeError) as e:
+            raise RosSmartException(message="Cannot load private key: %s" % e, original_exception=e)
+
+    def load_keys(self):
+        """
+            Read and parse any keys not already loaded. Called on the first request if the
+            client was created with lazy_keys=True.
+        """
+        # Cannot run  algorithm="rsa-sha256" at the moment, no valid key.
+        if self.public_key is None:
+            self.public_key = self._load_key(self.public_key_path, self.public_key_path, self.parse_public_key)
+        if self.signing_key is None:
+            if self.private_key is not None:
+                self.signing_key = self.parse_private_key(self.private_key)
+            else:
+                # The password is part of the cache key, so a cached key is only reused
+                # by clients that could have decrypted it themselves. The PEM is kept too,
+                # so private_key is set however the key was loaded.
+                self.private_key, self.signing_key = self._load_key(
+                    self.private_key_path, (self.private_key_path, self.hashed_password),
+                    lambda pem: (pem, self.parse_private_key(pem)))
+
+    def _load_key(self, path, cache_key, parse):
+        if path is None:
+            raise RosSmartException(message="No key material: supply key paths or public_key/private_key")
+        cache = self.key_cache
+        if cache is not None and cache_key in cache:
+            return cache[cache_key]
+        with open(path, 'rb') as fh:
+            key = parse(fh.read())
+        if cache is not None:
+            cache[cache_key] = key
+        return key
+
     def mk_unique_id(self):
         """
             Generate a unique-id. This just uses uuid.
@@ -362,14 +491,19 @@ class RosSmart:
 
             https://github.com/kislyuk/requests-http-signature
         """
+        HTTPSignatureHeaderAuth = _signature_auth_class()
+
+        if self.public_key is None or self.signing_key is None:
+            self.load_keys()
+
         headers=["(request-target)", "host", "date"]
         if post:
             headers.append('digest')
 
         return HTTPSignatureHeaderAuth(
             algorithm="rsa-sha512",
-            key=self.private_key,
-            passphrase=self.hashed_password,
+            key=self.signing_key,
+            passphrase=None,
             key_id=self.public_key.decode('utf-8'),
             headers=headers)
 
@@ -378,6 +512,8 @@ class RosSmart:
             Wrapper to perform HTTP GET
             query_params is a list of tupples (param, value), so that names can repeat
         """
+        import requests
+
         self._last_response = None
 
         url = self.url_root + url
@@ -407,6 +543,8 @@ class RosSmart:
             Wrapper to perform HTTP POST
             query_params is a list of tupples (param, value), so that names can repeat
         """
+        import requests
+
         self._last_response = None
 
         url = self.url_root + url
@@ -8,8 +8,14 @@ setup(
     long_description=open('README.rst').read(),
     install_requires=[
         "requests>=2.20.0",
-        "requests-http-signature>=0.1.0",
+        # rossmart.rossmart._signature_auth_class builds on the 0.2.x HTTPSignatureHeaderAuth
+        "requests-http-signature>=0.2.0,<0.3",
         "cryptography>=2.3.1",
         # "flex>=6.13.2",
     ],
+    extras_require={
+        # Columnar export, see rossmart/export.py
+        "arrow": ["pyarrow>=0.15.0"],
+        "numpy": ["numpy>=1.16.0"],
+    },
 )
@@ -0,0 +1,99 @@
+#
+#   Startup benchmark for short-lived workers.
+#
+#   Measures, in fresh interpreters:
+#
+#       import      time for "import rossmart"
+#       construct   time to create a RosSmart client (eager keys, lazy keys, in-memory keys)
+#       first call  time to import the http stack, load keys and sign the first request
+#       next call   time to sign a second request with the already parsed key
+#
+#   The first call is signed but not sent, so no network or ROS account is needed.
+#   Pass --live to also time a real handshake against the test server.
+#
+#       python tests/bench_startup.py [--repeat N] [--live]
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# Test set 2 keys are in the repository. See testset2/README.rst
+KEYS = {
+    "public_key_path": os.path.join(HERE, "testset2", "public_key"),
+    "private_key_path": os.path.join(HERE, "testset2", "private_key"),
+    "password": "997ed2e8",
+    "taxYear": "2019",
+    "employerRegistrationNumber": "8000278TH",
+    "test_server": True,
+}
+
+# Run in a fresh interpreter; prints a JSON dict of timings in milliseconds.
+SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+import rossmart
+t1 = time.perf_counter()
+
+mode, kwargs, live = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3] == "1"
+if mode == "memory":
+    with open(kwargs.pop("public_key_path"), "rb") as fh:
+        kwargs["public_key"] = fh.read()
+    with open(kwargs.pop("private_key_path"), "rb") as fh:
+        kwargs["private_key"] = fh.read()
+    t1 = time.perf_counter()
+elif mode == "lazy":
+    kwargs["lazy_keys"] = True
+api = rossmart.RosSmart(**kwargs)
+t2 = time.perf_counter()
+
+def call():
+    if live:
+        api.handshake()
+    else:
+        import requests
+        requests.Request("GET", api.url_root + "/handshake", auth=api._auth()).prepare()
+
+call()
+t3 = time.perf_counter()
+call()
+t4 = time.perf_counter()
+
+print(json.dumps({"import": (t1 - t0) * 1000, "construct": (t2 - t1) * 1000,
+                  "first call": (t3 - t2) * 1000, "next call": (t4 - t3) * 1000, "total": (t3 - t0) * 1000}))
+"""
+
+
+def run(mode, live):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    out = subprocess.check_output(
+        [sys.executable, "-c", SCRIPT, mode, json.dumps(KEYS), "1" if live else "0"], env=env)
+    return json.loads(out.decode("utf-8").strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--live", action="store_true", help="Send a real handshake to the test server")
+    args = parser.parse_args()
+
+    print("%-8s %12s %12s %12s %12s %12s   (median ms of %d runs)" % (
+        "mode", "import", "construct", "first call", "next call", "total", args.repeat))
+    for mode in ("eager", "lazy", "memory"):
+        runs = [run(mode, args.live) for i in range(args.repeat)]
+        median = {}
+        for key in runs[0]:
+            values = sorted(r[key] for r in runs)
+            median[key] = values[len(values) // 2]
+        print("%-8s %12.2f %12.2f %12.2f %12.2f %12.2f" % (
+            mode, median["import"], median["construct"], median["first call"], median["next call"],
+            median["total"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import contextlib
+import decimal
+import io
+import json
+import threading
+import unittest
+
+import rossmart
+from rossmart import cli
+
+
+class FakeApi(object):
+    """
+        Stands in for RosSmart.createPayrollSubmission. Submissions listed in fail raise.
+    """
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.submitted = []
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def mk_unique_id(self):
+        with self.lock:
+            self.count += 1
+            return "sub-%d" % self.count
+
+    def createPayrollSubmission(self, payrollRunReference, submissionID, payslips):
+        with self.lock:
+            self.submitted.append(submissionID)
+        if submissionID in self.fail:
+            raise rossmart.RosSmartException(message="failed", status_code=500, text="error")
+        return {}
+
+
+def ndjson(text):
+    return [json.loads(line) for line in text.splitlines()]
+
+
+class CsvTester(unittest.TestCase):
+
+    def read(self, text):
+        return list(cli.read_payslips(io.StringIO(text), 'csv'))
+
+    def test_00_dotted_columns(self):
+        payslips = self.read(
+            "lineItemID,employeeID.employeePpsn,employeeID.employmentID,name.firstName\n"
+            "L1,7133542CA,0,Floy\n")
+        self.assertEqual(payslips, [{
+            "lineItemID": "L1",
+            "employeeID": {"employeePpsn": "7133542CA", "employmentID": "0"},
+            "name": {"firstName": "Floy"}}])
+
+    def test_01_types(self):
+        payslip = self.read(
+            "grossPay,numberOfPayPeriods,prsiExempt,shadowPayroll,prsiClassDetails,rpnNumber\n"
+            '1000.50,52,true,no,"[{""prsiClass"": ""A1"", ""insurableWeeks"": 1}]",5\n')[0]
+        self.assertEqual(payslip["grossPay"], decimal.Decimal("1000.50"))
+        self.assertEqual(payslip["numberOfPayPeriods"], 52)
+        self.assertIs(payslip["prsiExempt"], True)
+        self.assertIs(payslip["shadowPayroll"], False)
+        self.assertEqual(payslip["prsiClassDetails"], [{"prsiClass": "A1", "insurableWeeks": 1}])
+        self.assertEqual(payslip["rpnNumber"], "5")
+
+    def test_02_nested_types(self):
+        payslip = self.read(
+            "lineItemID,address.addressLines,address.county,employeeID.employmentID\n"
+            'L1,"[""1 Main St"", ""Ballymore""]",Dublin,0\n')[0]
+        self.assertEqual(payslip["address"], {"addressLines": ["1 Main St", "Ballymore"], "county": "Dublin"})
+        self.assertEqual(payslip["employeeID"], {"employmentID": "0"})
+
+        with self.assertRaises(rossmart.RosSmartException) as cm:
+            self.read('lineItemID,address.addressLines\nL1,1 Main St\n')
+        self.assertIn("Invalid value for address.addressLines on row 2", str(cm.exception))
+
+    def test_03_empty_cells(self):
+        payslip = self.read("lineItemID,grossPay,employeeID.employmentID\nL1,,\n")[0]
+        self.assertEqual(payslip, {"lineItemID": "L1"})
+
+    def test_04_bad_values(self):
+        for header, value in [("grossPay", "abc"), ("numberOfPayPeriods", "x"), ("prsiClassDetails", "[")]:
+            with self.assertRaises(rossmart.RosSmartException) as cm:
+                self.read("lineItemID,%s\nL1,1\nL2,%s\n" % (header, value))
+            self.assertIn("Invalid value for %s on row 3" % header, str(cm.exception))
+
+    def test_05_bad_json_line(self):
+        with self.assertRaises(rossmart.RosSmartException) as cm:
+            list(cli.read_payslips(io.StringIO('{"a": 1}\n\n{bad\n'), 'ndjson'))
+        self.assertIn("line 3", str(cm.exception))
+
+
+class BatchTester(unittest.TestCase):
+
+    def test_00_batched(self):
+        self.assertEqual(list(cli.batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(cli.batched(range(4), 2)), [[0, 1], [2, 3]])
+        self.assertEqual(list(cli.batched([], 2)), [])
+
+
+class SubmitTester(unittest.TestCase):
+
+    def payslips(self, n):
+        return ({"lineItemID": "L%d" % i} for i in range(n))
+
+    def test_00_every_batch_reported(self):
+        api = FakeApi(fail=("sub-2",))
+        out = io.StringIO()
+        failed = cli.submit_payslips(api, "R1", self.payslips(25), out, batch_size=10, concurrency=2)
+        results = ndjson(out.getvalue())
+
+        self.assertEqual(failed, 1)
+        self.assertEqual(sorted(r["submissionID"] for r in results), sorted(api.submitted))
+        self.assertEqual(sorted(r["payslips"] for r in results), [5, 10, 10])
+        self.assertEqual([r["status_code"] for r in results if not r["ok"]], [500])
+
+    def test_01_input_error(self):
+        lines = ['{"lineItemID": "L%d"}' % i for i in range(5)] + ["{bad"] + ['{"lineItemID": "L9"}']
+        api = FakeApi()
+        out = io.StringIO()
+        with self.assertRaises(rossmart.RosSmartException):
+            cli.submit_payslips(api, "R1", cli.read_payslips(io.StringIO("\n".join(lines))), out,
+                batch_size=1, concurrency=3)
+        results = ndjson(out.getvalue())
+
+        # Every submission that was sent has a result, then the error record
+        self.assertEqual(sorted(r["submissionID"] for r in results[:-1]), sorted(api.submitted))
+        self.assertEqual(len(api.submitted), 5)
+        error = results[-1]
+        self.assertFalse(error["ok"])
+        self.assertEqual(error["payslipsSent"], 5)
+        self.assertIn("line 6", error["error"])
+
+
+class ArgumentTester(unittest.TestCase):
+
+    def test_00_tax_year_required(self):
+        argv = ["--public-key", "p", "--private-key", "k", "--password", "x", "--employer", "8000278TH"]
+        stderr = io.StringIO()
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(stderr):
+            cli.main(argv + ["--tax-year", "", "status", "--run-reference", "R1"])
+        self.assertIn("--tax-year is required", stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
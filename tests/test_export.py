@@ -0,0 +1,211 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import rossmart
+from rossmart import export
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+# Shaped like LookupRPNResponse and LookupPayrollDetailsByReturnPeriodResponse in
+# paye-employers-rest-api.json
+rpn_response = {
+    "employerName": "Test Employer",
+    "employerRegistrationNumber": "8000278TH",
+    "taxYear": 2019,
+    "totalRPNCount": 2,
+    "dateTimeEffective": "2019-01-02T10:00:00Z",
+    "rpns": [{
+        "rpnNumber": "5",
+        "employeeID": {"employeePpsn": "7009613EA", "employmentID": "0"},
+        "name": {"firstName": "Joan", "familyName": "Turner_TEST"},
+        "rpnIssueDate": "2018-11-09",
+        "effectiveDate": "2019-01-01",
+        "endDate": "2019-12-31",
+        "incomeTaxCalculationBasis": "CUMULATIVE",
+        "exclusionOrder": False,
+        "yearlyTaxCredits": 4950.0,
+        "taxRates": [
+            {"index": 1, "taxRatePercent": 20.0, "yearlyRateCutOff": 43550.0},
+            {"index": 2, "taxRatePercent": 40.0}],
+        "payForIncomeTaxToDate": 0.0,
+        "incomeTaxDeductedToDate": 0.0,
+        "uscStatus": "ORDINARY",
+        "uscRates": [
+            {"index": 1, "uscRatePercent": 0.5, "yearlyUSCRateCutOff": 12012.0},
+            {"index": 2, "uscRatePercent": 2.0, "yearlyUSCRateCutOff": 19372.0}],
+        "lptToDeduct": 0.0,
+    }, {
+        # Only the required fields, no bands
+        "rpnNumber": "1",
+        "employeeID": {"employeePpsn": "7133542CA"},
+        "name": {"firstName": "Floy", "familyName": "West"},
+        "rpnIssueDate": "2019-01-02",
+        "effectiveDate": "2019-01-02",
+        "endDate": "2019-12-31",
+        "incomeTaxCalculationBasis": "EMERGENCY",
+        "yearlyTaxCredits": 0,
+        "taxRates": [],
+        "payForIncomeTaxToDate": 0,
+        "incomeTaxDeductedToDate": 0,
+        "uscStatus": "ORDINARY",
+    }],
+}
+
+return_response = {
+    "employerReg": "8000278TH",
+    "returnPeriod": {"periodStartDate": "2019-01-01", "periodEndDate": "2019-01-31"},
+    "dateLastUpdated": "2019-02-14T09:30:00.000+0000",
+    "version": "1",
+    "periodSummary": {"taxOnIncome": 1200.5, "prsi": 400, "usc": 100, "lpt": 0},
+    "payrollRunDetails": [
+        {"payrollRunReference": "2019-01-07", "runDate": "2019-01-05", "multiPeriod": False,
+         "taxOnIncome": 600.25, "prsi": 200, "usc": 50, "lpt": 0},
+        {"payrollRunReference": "2019-01-14", "runDate": "2019-01-12", "multiPeriod": True,
+         "taxOnIncome": 600.25, "prsi": 200, "usc": 50, "lpt": 0}],
+}
+
+
+class FlattenTester(unittest.TestCase):
+
+    def test_00_rpn_rows(self):
+        rows = list(export.rpn_rows(rpn_response))
+        self.assertEqual(len(rows), 2)
+
+        row, rates = rows[0]
+        self.assertEqual(row["employerRegistrationNumber"], "8000278TH")
+        self.assertEqual(row["taxYear"], 2019)
+        self.assertEqual(row["employeePpsn"], "7009613EA")
+        self.assertEqual(row["employmentID"], "0")
+        self.assertEqual(row["familyName"], "Turner_TEST")
+        self.assertEqual(row["rpnIssueDate"], datetime.date(2018, 11, 9))
+        self.assertEqual(row["yearlyTaxCredits"], 4950.0)
+        self.assertEqual(set(row), set(name for name, type, width in export.RPN_COLUMNS))
+
+        self.assertEqual(
+            [(r["rateType"], r["index"], r["ratePercent"], r["cutOff"]) for r in rates],
+            [("TAX", 1, 20.0, 43550.0), ("TAX", 2, 40.0, None),
+             ("USC", 1, 0.5, 12012.0), ("USC", 2, 2.0, 19372.0)])
+        for rate in rates:
+            self.assertEqual(rate["rpnNumber"], "5")
+            self.assertEqual(rate["employeePpsn"], "7009613EA")
+            self.assertEqual(set(rate), set(name for name, type, width in export.RATE_COLUMNS))
+
+    def test_01_rpn_missing_fields(self):
+        row, rates = list(export.rpn_rows(rpn_response))[1]
+        self.assertEqual(rates, [])
+        self.assertIsNone(row["employmentID"])
+        self.assertIsNone(row["exclusionOrder"])
+        self.assertIsNone(row["payForUSCToDate"])
+        self.assertIsNone(row["prsiClass"])
+        self.assertEqual(row["yearlyTaxCredits"], 0.0)
+        self.assertEqual(list(export.rpn_rows({"totalRPNCount": 0})), [])
+
+    def test_02_return_rows(self):
+        row, runs = export.return_rows(return_response)
+        self.assertEqual(row["employerRegistrationNumber"], "8000278TH")
+        self.assertEqual(row["periodStartDate"], datetime.date(2019, 1, 1))
+        self.assertEqual(row["periodEndDate"], datetime.date(2019, 1, 31))
+        self.assertEqual(row["dateLastUpdated"], "2019-02-14T09:30:00.000+0000")
+        self.assertEqual(row["taxOnIncome"], 1200.5)
+        self.assertEqual(set(row), set(name for name, type, width in export.RETURN_COLUMNS))
+
+        self.assertEqual([r["payrollRunReference"] for r in runs], ["2019-01-07", "2019-01-14"])
+        self.assertEqual(runs[0]["runDate"], datetime.date(2019, 1, 5))
+        self.assertEqual(runs[1]["multiPeriod"], True)
+        self.assertEqual(runs[1]["periodEndDate"], datetime.date(2019, 1, 31))
+
+    def test_03_return_missing_fields(self):
+        row, runs = export.return_rows({"employerReg": "8000278TH", "validationErrors": [{"code": "1"}]})
+        self.assertEqual(runs, [])
+        self.assertIsNone(row["periodStartDate"])
+        self.assertIsNone(row["taxOnIncome"])
+
+    def test_04_dates(self):
+        self.assertEqual(export._date("2019-02-14T09:30:00Z"), datetime.date(2019, 2, 14))
+        self.assertIsNone(export._date(""))
+        self.assertRaises(ValueError, export._date, "14/02/2019")
+
+
+class WriterTester(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    def test_00_numpy(self):
+        with export.ColumnarExporter(self.path, format="numpy", chunk_size=3) as exporter:
+            for i in range(4):
+                exporter.add_rpns(rpn_response)
+            exporter.add_period_return(return_response)
+        rates = export.load_numpy(self.path, "rates")
+        self.assertEqual(len(rates["index"]), 16)
+        self.assertTrue(numpy.isnan(rates["cutOff"][1]))
+        self.assertEqual(str(export.load_numpy(self.path, "rpns")["endDate"][0]), "2019-12-31")
+        self.assertEqual(len(export.load_numpy(self.path, "payroll_runs")["runDate"]), 2)
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    def test_01_numpy_too_long(self):
+        response = dict(rpn_response, rpns=[dict(rpn_response["rpns"][0], prsiClass="A1X")])
+        exporter = export.ColumnarExporter(self.path, format="numpy")
+        exporter.add_rpns(response)
+        with self.assertRaises(ValueError):
+            exporter.close()
+        # No table is moved into place when one fails
+        files = sorted(os.listdir(self.path))
+        self.assertEqual(files, ["payroll_runs.partial", "rates.partial", "returns.partial", "rpns.partial"])
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    def test_02_numpy_failed_reexport(self):
+        with export.ColumnarExporter(self.path, format="numpy") as exporter:
+            exporter.add_rpns(rpn_response)
+
+        response = dict(rpn_response, rpns=[dict(rpn_response["rpns"][0], rpnNumber="NEW", prsiClass="A1X")])
+        exporter = export.ColumnarExporter(self.path, format="numpy")
+        exporter.add_rpns(response)
+        with self.assertRaises(ValueError):
+            exporter.close()
+
+        # The previous export is untouched and consistent
+        self.assertEqual(list(export.load_numpy(self.path, "rpns")["rpnNumber"]), ["5", "1"])
+        self.assertEqual(set(export.load_numpy(self.path, "rates")["rpnNumber"]), set(["5"]))
+
+    @unittest.skipUnless(pyarrow, "pyarrow is not installed")
+    def test_03_arrow(self):
+        with export.ColumnarExporter(self.path, format="arrow", chunk_size=3) as exporter:
+            exporter.add_rpns(rpn_response)
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(os.path.join(self.path, "rates.arrow"))).read_all()
+        self.assertEqual(table.num_rows, 4)
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(os.path.join(self.path, "returns.arrow"))).read_all()
+        self.assertEqual(table.num_rows, 0)
+
+    @unittest.skipUnless(pyarrow, "pyarrow is not installed")
+    def test_04_failed_export_left_partial(self):
+        with self.assertRaises(rossmart.RosSmartException):
+            with export.ColumnarExporter(self.path, format="parquet", chunk_size=1) as exporter:
+                exporter.add_rpns(rpn_response)
+                raise rossmart.RosSmartException(message="lookup failed")
+        files = sorted(os.listdir(self.path))
+        self.assertIn("rpns.parquet.partial", files)
+        self.assertNotIn("rpns.parquet", files)
+
+    def test_05_bad_format(self):
+        self.assertRaises(ValueError, export.ColumnarExporter, self.path, format="csv")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import base64
+import os
+import unittest
+
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+from cryptography.hazmat.primitives.hashes import SHA512
+from cryptography.x509 import load_pem_x509_certificate
+
+import rossmart
+
+# Test set 2 keys are in the repository. See testset2/README.rst
+HERE = os.path.dirname(os.path.abspath(__file__))
+public_key_path = os.path.join(HERE, "testset2", "public_key")
+private_key_path = os.path.join(HERE, "testset2", "private_key")
+password = "997ed2e8"
+
+
+def read(path):
+    with open(path, 'rb') as fh:
+        return fh.read()
+
+
+class KeyTester(unittest.TestCase):
+
+    def client(self, **kwargs):
+        params = dict(public_key_path=public_key_path, private_key_path=private_key_path, password=password,
+                      taxYear="2019", employerRegistrationNumber="8000278TH", test_server=True)
+        params.update(kwargs)
+        return rossmart.RosSmart(**params)
+
+    def signed_request(self, api):
+        return requests.Request("GET", api.url_root + "/handshake?softwareUsed=internal", auth=api._auth()).prepare()
+
+    def test_00_parse_public_key(self):
+        # The key id as built by the original readlines() loop
+        with open(public_key_path, 'rb') as fh:
+            expected = []
+            for line in fh.readlines():
+                if line and not line.startswith(b'----'):
+                    expected.append(line.strip())
+            expected = b''.join(expected)
+
+        self.assertEqual(rossmart.RosSmart.parse_public_key(read(public_key_path)), expected)
+        self.assertEqual(rossmart.RosSmart.parse_public_key(read(public_key_path).decode('ascii')), expected)
+        self.assertEqual(self.client().public_key, expected)
+
+    def test_01_signature(self):
+        api = self.client()
+        request = self.signed_request(api)
+
+        fields = dict(f.split("=", 1) for f in request.headers["Signature"].split(","))
+        self.assertEqual(fields["keyId"].strip('"'), api.public_key.decode('utf-8'))
+        self.assertEqual(fields["algorithm"], '"rsa-sha512"')
+
+        string_to_sign = "(request-target): get %s\nhost: softwaretest.ros.ie\ndate: %s" % (
+            request.path_url, request.headers["Date"])
+        certificate = load_pem_x509_certificate(read(public_key_path), default_backend())
+        certificate.public_key().verify(
+            base64.b64decode(fields["signature"].strip('"')), string_to_sign.encode('utf-8'), PKCS1v15(), SHA512())
+
+    def test_02_library_not_patched(self):
+        import requests_http_signature
+        crypto = requests_http_signature.Crypto
+        self.signed_request(self.client())
+        self.assertIs(requests_http_signature.Crypto, crypto)
+
+    def test_03_lazy_keys(self):
+        api = self.client(public_key_path="missing/public_key", private_key_path="missing/private_key",
+                          lazy_keys=True)
+        self.assertIsNone(api.public_key)
+        self.assertIsNone(api.signing_key)
+        self.assertRaises(IOError, api._auth)
+
+        api = self.client(lazy_keys=True)
+        self.assertIsNone(api.signing_key)
+        self.signed_request(api)
+        self.assertIsNotNone(api.signing_key)
+
+    def test_04_eager_keys(self):
+        self.assertRaises(IOError, self.client, public_key_path="missing/public_key")
+
+        # The private key is decrypted by the constructor
+        with self.assertRaises(rossmart.RosSmartException) as cm:
+            self.client(password="wrong")
+        self.assertIn("Cannot load private key", str(cm.exception))
+
+        api = self.client()
+        self.assertEqual(api.private_key, read(private_key_path))
+        self.assertIsNotNone(api.signing_key)
+
+    def test_05_in_memory_keys(self):
+        api = self.client(public_key_path=None, private_key_path=None,
+                          public_key=read(public_key_path), private_key=read(private_key_path).decode('ascii'))
+        self.assertEqual(api.public_key, self.client().public_key)
+        self.signed_request(api)
+
+    def test_06_key_cache(self):
+        cache = {}
+        first = self.client(key_cache=cache)
+        second = self.client(key_cache=cache)
+        self.assertIs(second.signing_key, first.signing_key)
+        self.assertIs(second.public_key, first.public_key)
+        self.assertEqual(second.private_key, read(private_key_path))
+        self.assertEqual(len(cache), 2)
+
+        # Not shared with a different password
+        with self.assertRaises(rossmart.RosSmartException):
+            self.client(key_cache=cache, password="wrong")
+
+    def test_07_no_key_material(self):
+        with self.assertRaises(rossmart.RosSmartException) as cm:
+            rossmart.RosSmart(password=password)
+        self.assertIn("No key material", str(cm.exception))
+
+        api = rossmart.RosSmart(password=password, lazy_keys=True)
+        self.assertRaises(rossmart.RosSmartException, api._auth)
+
+
+if __name__ == '__main__':
+    unittest.main()